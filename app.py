@@ -1,167 +1,758 @@
-from flask import Flask, request, jsonify, Response, stream_with_context
+"""yt-dlp audio extraction service.
+
+Production: run under gunicorn with threaded workers (see gunicorn.conf.py):
+    gunicorn --config gunicorn.conf.py wsgi:app
+The ``__main__`` block below starts Flask's development server for local use only.
+"""
+from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import ClosingIterator, wrap_file
 from flask_cors import CORS
-import yt_dlp
+import orjson
+import copy
+import io
 import os
+import re
 import logging
 import requests
-import io
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import base64
+import hashlib
+import hmac
 import subprocess
 import tempfile
 import shutil
-from urllib.parse import urlparse
+import socket
+import threading
+import queue
+import atexit
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait
+from types import MappingProxyType
+from urllib.parse import quote, urlsplit
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster jsonify responses"""
+
+    options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Same arguments as jsonify(): one value, several (serialized as a
+        # list) or keyword arguments (serialized as a dict), never both
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        # Hand orjson's bytes straight to the response instead of decoding to
+        # str and letting Werkzeug encode it again
+        body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed number of seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries over maxsize"""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop an entry if present"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+# Process-wide getaddrinfo cache. yt-dlp and requests resolve youtube.com and
+# googlevideo hosts over and over; a short TTL keeps lookups cheap without
+# pinning stale CDN addresses. Set DNS_CACHE_TTL=0 to disable.
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 60))
+dns_cache = TTLCache(maxsize=4096, ttl=DNS_CACHE_TTL)
+original_getaddrinfo = socket.getaddrinfo
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """socket.getaddrinfo with a small TTL cache in front of it"""
+    key = (host, port, family, type, proto, flags)
+    result = dns_cache.get(key)
+    if result is None:
+        result = original_getaddrinfo(host, port, family, type, proto, flags)
+        dns_cache.set(key, result)
+    return result
+
+if DNS_CACHE_TTL > 0:
+    socket.getaddrinfo = cached_getaddrinfo
+
+# Watch, shorts, embed, live and youtu.be links; anything else (channels,
+# playlists, look-alike hosts) is not a single video this service can fetch
+YOUTUBE_VIDEO_ID_RE = re.compile(
+    r'^https?://(?:(?:www\.|m\.)?youtube\.com/(?:watch\?(?:[^#]*&)?v=|(?:shorts|embed|live|v)/)|youtu\.be/)'
+    r'([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])',
+    re.IGNORECASE
+)
+
+# Enhanced headers for streaming media from YouTube in /download
+STREAM_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'keep-alive',
+    'Referer': 'https://www.youtube.com/',
+    'Origin': 'https://www.youtube.com',
+    'Sec-Fetch-Dest': 'video',
+    'Sec-Fetch-Mode': 'no-cors',
+    'Sec-Fetch-Site': 'cross-site',
+    'Range': 'bytes=0-',  # Request range to enable streaming
+}
+
+# Shared HTTP session so /download, /process and oEmbed lookups reuse
+# keep-alive TLS connections instead of handshaking on every request;
+# transient 502/503/504s from the CDN are retried before the body is read
+http_session = requests.Session()
+http_retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), raise_on_status=False)
+http_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=http_retry)
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+
+# Chunk size for relaying media bytes to the client; files on disk are
+# sent with sendfile() and do not go through these chunks
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_BYTES', 256 * 1024))
+
+# Headers for fetching media from YouTube in /process
+PROCESS_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'keep-alive',
+    'Referer': 'https://www.youtube.com/',
+    'Origin': 'https://www.youtube.com',
+}
+
+# no-transform keeps proxies from gzipping already-compressed audio, and
+# X-Accel-Buffering stops nginx from buffering a stream before relaying it
+PROCESS_RESPONSE_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate, no-transform',
+    'X-Accel-Buffering': 'no',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+    'X-Content-Type-Options': 'nosniff',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'X-Audio-Compression': 'whisper-optimized',
+    'X-Audio-Bitrate': '64kbps',
+    'X-Audio-Format': 'm4a-mono-16khz',
+}
+
+# Encodings /process can produce, chosen with ?codec=. AAC in MP4 is the
+# default; Opus keeps speech intelligible at a lower bitrate, so its files
+# are smaller. Both are accepted by Whisper.
+WHISPER_CODECS = {
+    'aac': {
+        'ext': 'm4a',
+        'content_type': 'audio/mp4',
+        'headers': PROCESS_RESPONSE_HEADERS,
+    },
+    'opus': {
+        'ext': 'ogg',
+        'content_type': 'audio/ogg',
+        'headers': {
+            **PROCESS_RESPONSE_HEADERS,
+            'X-Audio-Bitrate': '16kbps',
+            'X-Audio-Format': 'opus-mono-16khz',
+        },
+    },
+}
+
+# Storyboard/thumbnail URLs that yt-dlp sometimes returns instead of media.
+# Image extensions are only looked for at the end of the URL path, so a
+# query value ending in ".png" does not reject a media URL
+STORYBOARD_RE = re.compile(r'storyboard', re.IGNORECASE)
+IMAGE_PATH_RE = re.compile(r'\.(?:jpe?g|png|webp)$', re.IGNORECASE)
+
+def is_bad_url(url):
+    """Whether a format URL points at a storyboard or thumbnail image rather than media"""
+    return bool(STORYBOARD_RE.search(url) or IMAGE_PATH_RE.search(urlsplit(url).path))
+
+# Characters stripped from titles used as download filenames; \w covers the
+# same Unicode alphanumerics as str.isalnum() plus underscore
+UNSAFE_FILENAME_RE = re.compile(r'[^\w .\-]+')
+
+# Container preference for audio-only formats; bitrate breaks ties within one
+AUDIO_EXT_PRIORITY = {'m4a': 2, 'webm': 1}
+
+def attachment_disposition(title, ext):
+    """Content-Disposition header naming a download after the video title.
+
+    Header values must be latin-1, so non-ASCII titles are sent in the RFC
+    5987 filename* parameter with an ASCII-only filename as fallback.
+    """
+    safe_title = UNSAFE_FILENAME_RE.sub('', title).rstrip() or 'audio'
+    filename = f"{safe_title}.{ext}"
+    if filename.isascii():
+        return f'attachment; filename="{filename}"'
+    ascii_title = safe_title.encode('ascii', 'ignore').decode().strip() or 'audio'
+    return f'attachment; filename="{ascii_title}.{ext}"; filename*=UTF-8\'\'{quote(filename)}'
+
 def is_valid_youtube_url(url):
-    """Validate if the URL is a valid YouTube URL"""
-    parsed = urlparse(url)
-    youtube_domains = ['youtube.com', 'www.youtube.com', 'youtu.be', 'm.youtube.com']
-    return parsed.netloc in youtube_domains
+    """Validate if the URL is a YouTube URL pointing at a single video"""
+    return YOUTUBE_VIDEO_ID_RE.match(url) is not None
+
+# Persistent yt-dlp cache (player JS, nsig/signature transforms). Point this at
+# a mounted volume so the cache survives container restarts.
+YTDLP_CACHE_DIR = os.environ.get('YTDLP_CACHE_DIR', '/var/cache/ytdlp')
+
+# Browser-like headers for yt-dlp's page and API requests
+YDL_HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-us,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Cache-Control': 'max-age=0'
+}
+
+# Base yt-dlp configuration for YouTube's latest requirements
+YDL_BASE_OPTS = {
+    'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
+    'noplaylist': True,
+    'playlist_items': '1',
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+    'no_color': True,
+    'check_formats': False,
+    'getcomments': False,
+    'writesubtitles': False,
+    'writeautomaticsub': False,
+    'compat_opts': ['no-youtube-unavailable-videos'],
+    'extract_flat': 'in_playlist',
+    'writeinfojson': False,
+    'writethumbnail': False,
+    'skip_download': True,
+    'simulate': True,
+    'cachedir': YTDLP_CACHE_DIR,
+    'http_headers': YDL_HTTP_HEADERS,
+    'socket_timeout': 30,
+    'retries': 3,
+    'fragment_retries': 3,
+    'skip_unavailable_fragments': True,
+    'youtube_include_dash_manifest': False,
+    'youtube_include_hls_manifest': False,
+}
+
+# Try multiple extraction methods as fallbacks
+EXTRACTION_METHODS = (
+    ('Primary extraction with ios client', 'ios'),
+    ('Fallback with android client', 'android'),
+    ('Final fallback with web client', 'web'),
+)
+
+def build_ydl_opts(client):
+    """Build yt-dlp options pinned to a single YouTube player client"""
+    # Deep copy so no nested dict (headers, extractor args) is shared between clients
+    opts = copy.deepcopy(YDL_BASE_OPTS)
+    opts['extractor_args'] = {
+        'youtube': {
+            'player_client': [client],
+            'skip': ['dash', 'hls'],
+        }
+    }
+    return opts
+
+# Options for each player client, built once at import time. These are
+# read-only templates: YoutubeDL mutates the params dict it is given, so each
+# instance gets its own copy.
+YDL_OPTS_BY_CLIENT = MappingProxyType({client: build_ydl_opts(client) for _, client in EXTRACTION_METHODS})
+
+# Long-lived YoutubeDL instances, pooled per player client, so extractor and
+# networking setup is paid once per worker instead of on every request.
+# yt-dlp routes through its Requests handler (needs requests>=2.32.2), whose
+# urllib3 pool keeps connections to YouTube alive across calls.
+# Instances are created on first use so importing the app (and serving the
+# health check) does not wait on yt-dlp's heavy import. A YoutubeDL object is
+# not thread-safe, so each one is checked out by a single thread at a time.
+# That caps concurrent extractions per client at YDL_POOL_SIZE per worker,
+# below the extraction executor's thread count: further extractions for the
+# client queue for an instance and give up after YDL_BORROW_TIMEOUT seconds,
+# leaving the race to the other clients.
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 2))
+YDL_BORROW_TIMEOUT = float(os.environ.get('YDL_BORROW_TIMEOUT', 20))
+YDL_POOL = {client: queue.LifoQueue() for client in YDL_OPTS_BY_CLIENT}
+ydl_instances = []
+ydl_created = {client: 0 for client in YDL_OPTS_BY_CLIENT}
+ydl_pool_lock = threading.Lock()
+
+def create_ydl(client):
+    """Create a YoutubeDL for a client if the pool has room, importing yt-dlp on first use"""
+    with ydl_pool_lock:
+        if ydl_created[client] >= YDL_POOL_SIZE:
+            return None
+        ydl_created[client] += 1
+    # Build outside the lock so the clients racing on a cold worker do not
+    # construct their instances one after another
+    try:
+        import yt_dlp
+        ydl = yt_dlp.YoutubeDL(copy.deepcopy(YDL_OPTS_BY_CLIENT[client]))
+    except Exception:
+        with ydl_pool_lock:
+            ydl_created[client] -= 1
+        raise
+    with ydl_pool_lock:
+        ydl_instances.append(ydl)
+    return ydl
+
+@contextmanager
+def borrow_ydl(client):
+    """Check out a pooled YoutubeDL for a client, waiting for one if the pool is exhausted"""
+    pool = YDL_POOL[client]
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = create_ydl(client)
+        if ydl is None:
+            try:
+                ydl = pool.get(timeout=YDL_BORROW_TIMEOUT)
+            except queue.Empty:
+                raise Exception(
+                    f"yt-dlp busy: all {YDL_POOL_SIZE} {client} instances in use for {YDL_BORROW_TIMEOUT:g}s"
+                ) from None
+    try:
+        yield ydl
+    finally:
+        pool.put(ydl)
+
+def warm_ydl_pool():
+    """Import yt-dlp and build the YoutubeDL pool ahead of the first request"""
+    try:
+        for client in YDL_OPTS_BY_CLIENT:
+            if YDL_POOL[client].empty():
+                ydl = create_ydl(client)
+                if ydl:
+                    YDL_POOL[client].put(ydl)
+        logger.info("yt-dlp pool warmed up")
+    except Exception as e:
+        logger.warning("Failed to warm up yt-dlp pool: %s", e)
+
+# Player client that produced the most recent successful extraction in this
+# worker; it is tried first with a short head start before the others
+last_good_client = None
+EXTRACTION_HEAD_START = float(os.environ.get('EXTRACTION_HEAD_START', 3))
+
+# Shared pool used to race the player clients against each other
+extraction_executor = ThreadPoolExecutor(max_workers=len(EXTRACTION_METHODS) * 4, thread_name_prefix='extract')
+
+@atexit.register
+def close_ydl_pool():
+    """Release network resources held by the pooled YoutubeDL instances"""
+    for ydl in list(ydl_instances):
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning("Failed to close YoutubeDL instance: %s", e)
+
+# Extraction results keyed by video ID, shared by /extract, /download and
+# /process. Signed googlevideo URLs stay valid for ~6 hours, so entries
+# expire well before that by default.
+EXTRACT_CACHE_MAXSIZE = int(os.environ.get('EXTRACT_CACHE_MAXSIZE', 4096))
+EXTRACT_CACHE_TTL = int(os.environ.get('EXTRACT_CACHE_TTL', 5 * 3600))
+extract_cache = TTLCache(maxsize=EXTRACT_CACHE_MAXSIZE, ttl=EXTRACT_CACHE_TTL)
+
+# Optional Redis cache shared by every worker and instance. Enabled by
+# REDIS_URL; without it only the in-process cache above is used.
+REDIS_URL = os.environ.get('REDIS_URL')
+SHARED_LOCK_TTL = 60
+redis_client = None
+if REDIS_URL:
+    try:
+        import redis
+        redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+    except ImportError:
+        logger.warning("REDIS_URL is set but the redis package is not installed; using the in-process cache only")
+
+def shared_cache_get(video_id):
+    """Read an extraction result from Redis, or None if unavailable"""
+    if redis_client is None:
+        return None
+    try:
+        raw = redis_client.get(f'ytaudio:{video_id}')
+        return orjson.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning("Redis cache read failed: %s", e)
+        return None
+
+def shared_cache_set(video_id, result):
+    """Store an extraction result in Redis with the extraction cache TTL"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(f'ytaudio:{video_id}', EXTRACT_CACHE_TTL, orjson.dumps(result))
+    except Exception as e:
+        logger.warning("Redis cache write failed: %s", e)
+
+def shared_cache_delete(video_id):
+    """Drop an extraction result from Redis"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(f'ytaudio:{video_id}')
+    except Exception as e:
+        logger.warning("Redis cache delete failed: %s", e)
+
+def shared_lock_acquire(video_id):
+    """Try to take the per-video extraction lock; True when acquired or Redis is unavailable"""
+    if redis_client is None:
+        return True
+    try:
+        return bool(redis_client.set(f'ytaudio:lock:{video_id}', 1, nx=True, ex=SHARED_LOCK_TTL))
+    except Exception as e:
+        logger.warning("Redis lock failed: %s", e)
+        return True
+
+def shared_lock_release(video_id):
+    """Release the per-video extraction lock"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(f'ytaudio:lock:{video_id}')
+    except Exception as e:
+        logger.warning("Redis unlock failed: %s", e)
+
+def shared_cache_wait(video_id, timeout=SHARED_LOCK_TTL, interval=0.5):
+    """Poll Redis for a result another worker is extracting; None if it never shows up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        cached = shared_cache_get(video_id)
+        if cached:
+            logger.info("Shared cache filled by another worker for video %s", video_id)
+            return cached
+        try:
+            if not redis_client.exists(f'ytaudio:lock:{video_id}'):
+                return None
+        except Exception:
+            return None
+    return None
+
+def extract_video_id(url):
+    """Extract the YouTube video ID from a watch, shorts or youtu.be URL"""
+    match = YOUTUBE_VIDEO_ID_RE.match(url)
+    return match.group(1) if match else None
+
+def pick_info_url(info):
+    """Method 1: use the URL yt-dlp selected itself, unless it is a storyboard/image"""
+    audio_url = info.get('url')
+    if audio_url and not is_bad_url(audio_url):
+        logger.debug("Found main URL: %.100s...", audio_url)
+        return info
+    return None
+
+def pick_best_format(formats):
+    """Methods 2/3: best-ranked audio-only format, else the highest-bitrate mixed format.
+
+    Each format gets one score tuple (audio_only, container priority,
+    bitrate), so a single pass and a single comparison pick the winner.
+    """
+    best = None
+    best_score = None
+    for fmt in formats:
+        # Read each field once into locals
+        get = fmt.get
+        acodec = get('acodec')
+        url_fmt = get('url')
+
+        # Skip storyboards, images and formats without audio or URL
+        if not url_fmt or acodec is None or acodec == 'none' or is_bad_url(url_fmt):
+            continue
+
+        abr = get('abr') or 0
+        vcodec = get('vcodec')
+        if vcodec is not None and vcodec != 'none':
+            # Mixed audio+video formats rank below any audio-only one
+            score = (False, 0, abr)
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Audio format found: %s - %s - %skbps", get('format_id'), acodec, abr)
+            score = (True, AUDIO_EXT_PRIORITY.get(get('ext'), 0), abr)
+        if best_score is None or score > best_score:
+            best, best_score = fmt, score
+
+    if best is not None:
+        kind = 'audio' if best_score[0] else 'mixed'
+        logger.info("Selected %s format: %s (%s)", kind, best.get('format_id'), best.get('ext'))
+    return best
+
+def extract_with_client(url, client, done=None):
+    """Run a single player client and pick its audio URL, or return None if it only yields storyboards/images"""
+    # Reuse a pooled instance for this client
+    with borrow_ydl(client) as ydl:
+        # Another client already won the race while we waited for an instance
+        if done is not None and done.is_set():
+            return None
+        # Skip yt-dlp's format-selection/post-processing stage; we pick the
+        # audio format ourselves and only need processing when the raw result
+        # is a redirect or carries no direct media URLs
+        info = ydl.extract_info(url, download=False, process=False)
+        if info.get('_type') == 'playlist':
+            # Bare playlist URLs: only the first entry is ever used, so resolve
+            # just that one instead of processing the whole list
+            info = next(iter(info.get('entries') or ()), None)
+            if info is None:
+                raise Exception("Playlist contains no videos")
+        if info.get('_type', 'video') != 'video' or not any(fmt.get('url') for fmt in info.get('formats') or ()):
+            # Processing resolves signatures and is the slow half; skip it
+            # if another client has won in the meantime
+            if done is not None and done.is_set():
+                return None
+            info = ydl.process_ie_result(info, download=False)
+
+    # Debug: log all available formats
+    formats = info.get('formats', [])
+    logger.info("Found %d formats with %s client", len(formats), client)
+
+    # Stop at the first method that yields a real media URL
+    selected = pick_info_url(info) or pick_best_format(formats)
+    if selected is None:
+        logger.warning("%s client returned storyboard/image URLs only", client)
+        return None
+
+    audio_url = selected['url']
+    logger.info("Success with %s client", client)
+    logger.debug("Final audio URL: %.100s...", audio_url)
+    return {
+        'audio_url': audio_url,
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'filesize': selected.get('filesize') or selected.get('filesize_approx'),
+        'success': True,
+        'extraction_method': client
+    }
+
+def forget_rejected_extraction(url, error):
+    """Drop the cached extraction for a URL if YouTube refused its media URL (403/410)"""
+    response = getattr(error, 'response', None)
+    if not url or response is None or response.status_code not in (403, 410):
+        return
+    video_id = extract_video_id(url)
+    if video_id:
+        extract_cache.delete(video_id)
+        shared_cache_delete(video_id)
+        logger.info("Dropped cached extraction for video %s after HTTP %s", video_id, response.status_code)
+
+def run_extraction(url):
+    """Race the player clients for a URL and return the first usable result, raising if all fail"""
+    futures = {}
+    errors = []
+    done = threading.Event()
+
+    def launch(methods):
+        for method_name, client in methods:
+            logger.info("Attempting %s", method_name)
+            futures[extraction_executor.submit(extract_with_client, url, client, done)] = method_name
+
+    def collect(future):
+        method_name = futures.pop(future)
+        try:
+            result = future.result()
+        except Exception as method_error:
+            logger.warning("Method %s failed: %s", method_name, method_error)
+            errors.append(f"{method_name}: {str(method_error)[:200]}")
+            return None
+        if result is None:
+            errors.append(f"{method_name}: only storyboard/image URLs")
+        return result
+
+    def finish(result):
+        global last_good_client
+        done.set()
+        for pending in futures:
+            pending.cancel()
+        last_good_client = result['extraction_method']
+        return result
+
+    methods = EXTRACTION_METHODS
+    preferred = last_good_client
+    if preferred:
+        # Give the client that won last time a head start and only fan out
+        # to the others if it is slow or fails
+        methods = sorted(EXTRACTION_METHODS, key=lambda method: method[1] != preferred)
+        launch(methods[:1])
+        first = next(iter(futures))
+        futures_wait([first], timeout=EXTRACTION_HEAD_START)
+        if first.done():
+            result = collect(first)
+            if result:
+                return finish(result)
+        methods = methods[1:]
+
+    # Race the remaining player clients and take the first usable result
+    launch(methods)
+    for future in as_completed(list(futures)):
+        result = collect(future)
+        if result:
+            return finish(result)
+
+    # If all methods failed, report why each client did
+    raise Exception(
+        "All extraction methods failed. YouTube may have updated their protection mechanisms. "
+        f"({'; '.join(errors)})"
+    )
 
 def extract_audio_info(url, format_preference='m4a'):
     """Extract audio download URL and metadata from YouTube video"""
     try:
-        # Enhanced yt-dlp configuration for YouTube's latest requirements
-        ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best',
-            'noplaylist': True,
-            'quiet': False,  # Enable logging to debug
-            'no_warnings': False,
-            'extract_flat': False,
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['ios', 'android'],  # Simplified, reliable clients
-                    'skip': ['dash', 'hls'],
-                    'check_formats': None,
-                }
-            },
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'none',
-                'Cache-Control': 'max-age=0'
-            },
-            'socket_timeout': 30,
-            'retries': 3,
-            'fragment_retries': 3,
-            'skip_unavailable_fragments': True,
+        video_id = extract_video_id(url)
+        if not video_id:
+            return run_extraction(url)
+
+        cached = extract_cache.get(video_id)
+        if cached:
+            logger.info("Cache hit for video %s", video_id)
+            return cached
+
+        cached = shared_cache_get(video_id)
+        if cached:
+            logger.info("Shared cache hit for video %s", video_id)
+            extract_cache.set(video_id, cached)
+            return cached
+
+        # Only one worker extracts a given video at a time; the others wait
+        # for its result instead of hitting YouTube in parallel
+        locked = shared_lock_acquire(video_id)
+        if not locked:
+            cached = shared_cache_wait(video_id)
+            if cached:
+                extract_cache.set(video_id, cached)
+                return cached
+
+        try:
+            result = run_extraction(url)
+        finally:
+            if locked:
+                shared_lock_release(video_id)
+
+        extract_cache.set(video_id, result)
+        shared_cache_set(video_id, result)
+        return result
+
+    except Exception as e:
+        logger.error("Error extracting audio info: %s", e)
+        return {
+            'error': str(e),
+            'success': False
         }
 
-        # Try multiple extraction methods as fallbacks
-        extraction_methods = [
-            ('Primary extraction with ios client', 'ios'),
-            ('Fallback with android client', 'android'),
-            ('Final fallback with web client', 'web'),
-        ]
+# Metadata that YouTube's oEmbed endpoint provides in one cheap request,
+# with no player JS or signature work
+OEMBED_URL = 'https://www.youtube.com/oembed'
+OEMBED_FIELDS = frozenset(('title', 'author', 'thumbnail'))
+oembed_cache = TTLCache(maxsize=EXTRACT_CACHE_MAXSIZE, ttl=3600)
 
-        for method_name, client in extraction_methods:
-            try:
-                logger.info(f"Attempting {method_name}")
-
-                # Update client for this attempt
-                current_opts = ydl_opts.copy()
-                current_opts['extractor_args']['youtube']['player_client'] = [client]
-
-                with yt_dlp.YoutubeDL(current_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-
-                    # Debug: log all available formats
-                    formats = info.get('formats', [])
-                    logger.info(f"Found {len(formats)} formats with {client} client")
-
-                    # Look specifically for audio streams
-                    audio_url = None
-
-                    # Method 1: Use yt-dlp's format selection
-                    if 'url' in info:
-                        audio_url = info['url']
-                        logger.info(f"Found main URL: {audio_url[:100]}...")
-
-                    # Method 2: Manual format selection if main URL is not good
-                    if not audio_url or 'storyboard' in audio_url or 'jpg' in audio_url:
-                        # Filter for audio-only formats
-                        audio_formats = []
-                        for fmt in formats:
-                            acodec = fmt.get('acodec', 'none')
-                            vcodec = fmt.get('vcodec', 'none')
-                            url_fmt = fmt.get('url', '')
-
-                            # Skip if it's a storyboard or image
-                            if 'storyboard' in url_fmt or '.jpg' in url_fmt or '.png' in url_fmt:
-                                continue
-
-                            # Audio-only formats (no video)
-                            if acodec != 'none' and vcodec == 'none':
-                                audio_formats.append(fmt)
-                                logger.info(f"Audio format found: {fmt.get('format_id')} - {acodec} - {fmt.get('abr')}kbps")
-
-                        if audio_formats:
-                            # Sort by audio bitrate, prefer higher quality
-                            audio_formats.sort(key=lambda x: x.get('abr', 0) or 0, reverse=True)
-
-                            # Prefer m4a format if available
-                            m4a_formats = [f for f in audio_formats if f.get('ext') == 'm4a']
-                            if m4a_formats:
-                                audio_url = m4a_formats[0].get('url')
-                                logger.info(f"Selected m4a format: {m4a_formats[0].get('format_id')}")
-                            else:
-                                audio_url = audio_formats[0].get('url')
-                                logger.info(f"Selected best audio format: {audio_formats[0].get('format_id')}")
-
-                    # Method 3: Fallback to any format with audio
-                    if not audio_url or 'storyboard' in audio_url or 'jpg' in audio_url:
-                        logger.warning("No pure audio format found, looking for mixed formats...")
-                        for fmt in formats:
-                            url_fmt = fmt.get('url', '')
-                            acodec = fmt.get('acodec', 'none')
-
-                            # Skip storyboards and images
-                            if 'storyboard' in url_fmt or '.jpg' in url_fmt or '.png' in url_fmt:
-                                continue
-
-                            if acodec != 'none':
-                                audio_url = url_fmt
-                                logger.info(f"Selected mixed format: {fmt.get('format_id')}")
-                                break
-
-                    # Validate the URL doesn't contain image extensions
-                    if audio_url and 'storyboard' not in audio_url and '.jpg' not in audio_url and '.png' not in audio_url:
-                        logger.info(f"Success with {client} client! Final audio URL: {audio_url[:100]}...")
-                        return {
-                            'audio_url': audio_url,
-                            'title': info.get('title', 'Unknown'),
-                            'duration': info.get('duration', 0),
-                            'success': True,
-                            'extraction_method': client
-                        }
-                    else:
-                        logger.warning(f"{client} client returned storyboard/image URLs only")
-
-            except Exception as method_error:
-                logger.warning(f"Method {method_name} failed: {str(method_error)}")
-                continue
-
-        # If all methods failed
-        raise Exception("All extraction methods failed. YouTube may have updated their protection mechanisms.")
+def extract_light(url):
+    """Fetch title/author/thumbnail from YouTube's oEmbed endpoint without running yt-dlp"""
+    try:
+        video_id = extract_video_id(url)
+        if video_id:
+            cached = oembed_cache.get(video_id)
+            if cached:
+                logger.info("oEmbed cache hit for video %s", video_id)
+                return cached
+
+        response = http_session.get(OEMBED_URL, params={'url': url, 'format': 'json'}, timeout=(5, 10))
+        response.raise_for_status()
+        data = response.json()
+
+        result = {
+            'title': data.get('title', 'Unknown'),
+            'author': data.get('author_name'),
+            'thumbnail': data.get('thumbnail_url'),
+            'success': True,
+            'extraction_method': 'oembed'
+        }
+        if video_id:
+            oembed_cache.set(video_id, result)
+        return result
 
     except Exception as e:
-        logger.error(f"Error extracting audio info: {str(e)}")
+        logger.error("Error fetching oEmbed metadata: %s", e)
         return {
             'error': str(e),
             'success': False
         }
 
+# Signed /extract -> /download hand-off so /download can skip a second
+# extraction. Disabled unless a secret shared by all workers is configured.
+DOWNLOAD_TOKEN_SECRET = os.environ.get('DOWNLOAD_TOKEN_SECRET', '').encode()
+DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 900))
+
+def sign_token_payload(payload):
+    """Return the base64url HMAC-SHA256 signature for an encoded token payload"""
+    digest = hmac.new(DOWNLOAD_TOKEN_SECRET, payload, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=')
+
+def make_download_token(result):
+    """Build a signed, expiring token carrying the audio URL and title of an extraction"""
+    payload = base64.urlsafe_b64encode(orjson.dumps({
+        'u': result['audio_url'],
+        't': result.get('title', 'audio'),
+        'e': int(time.time()) + DOWNLOAD_TOKEN_TTL,
+    })).rstrip(b'=')
+    return (payload + b'.' + sign_token_payload(payload)).decode()
+
+def read_download_token(token):
+    """Verify a download token and return its payload, or None if invalid or expired"""
+    try:
+        payload, signature = token.encode().split(b'.', 1)
+        if not hmac.compare_digest(signature, sign_token_payload(payload)):
+            return None
+        data = orjson.loads(base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4)))
+    except Exception:
+        return None
+    if data.get('e', 0) < time.time():
+        return None
+    return data
+
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -172,12 +763,16 @@ def health_check():
         'endpoints': {
             '/extract': 'Extract audio URL from YouTube video',
             '/download': 'Download audio file server-side and stream to client (bypasses 403 errors)',
-            '/process': 'Complete pipeline: extract + compress audio for Whisper (with segmentation for large files)'
+            '/process': 'Complete pipeline: extract + compress audio for Whisper (with segmentation for large files)',
+            '/process_full': 'Every 10-minute segment compressed for Whisper, returned as a zip',
+            '/status/<job_id>': 'State of a background /process?async=1 job',
+            '/result/<job_id>': 'Audio produced by a finished background job'
         },
         'features': {
             'segmentation': 'Large files (>100MB) automatically split into 10-minute segments',
             'timeout_safety': 'Railway-optimized processing to prevent worker timeouts',
-            'whisper_optimization': 'Audio compressed to <25MB for OpenAI Whisper'
+            'whisper_optimization': 'Audio compressed to <25MB for OpenAI Whisper',
+            'metadata_fast_path': '/extract?fields=title,author,thumbnail skips yt-dlp via oEmbed'
         }
     })
 
@@ -203,10 +798,24 @@ def extract_audio():
                 'success': False
             }), 400
 
-        # Extract audio information
-        result = extract_audio_info(url, format_preference)
+        # Optional comma-separated field selection; title/author/thumbnail
+        # alone are served from oEmbed without running yt-dlp
+        fields = [field for field in request.args.get('fields', '').split(',') if field]
+        if not fields and request.args.get('meta_only', '').lower() in ('1', 'true'):
+            # Shorthand for every field oEmbed provides
+            fields = ['title', 'author', 'thumbnail']
+
+        if fields and OEMBED_FIELDS.issuperset(fields):
+            result = extract_light(url)
+        else:
+            # Extract audio information
+            result = extract_audio_info(url, format_preference)
 
         if result.get('success'):
+            if fields:
+                result = {**{field: result.get(field) for field in fields}, 'success': True}
+            elif DOWNLOAD_TOKEN_SECRET and result.get('audio_url'):
+                result = {**result, 'download_token': make_download_token(result)}
             return jsonify(result), 200
         else:
             return jsonify(result), 500
@@ -222,86 +831,125 @@ def extract_audio():
 def download_audio():
     """Download audio file server-side and stream it back to bypass YouTube detection"""
     try:
-        # Get URL parameter
-        url = request.args.get('url')
-        if not url:
-            return jsonify({
-                'error': 'Missing required parameter: url',
-                'success': False
-            }), 400
-
         # Get format parameter (default to m4a)
         format_preference = request.args.get('format', 'm4a')
 
-        # Validate YouTube URL
-        if not is_valid_youtube_url(url):
-            return jsonify({
-                'error': 'Invalid YouTube URL provided',
-                'success': False
-            }), 400
+        # A download token from /extract already carries the audio URL
+        token = request.args.get('token')
+        if token and DOWNLOAD_TOKEN_SECRET:
+            token_data = read_download_token(token)
+            if token_data is None:
+                return jsonify({
+                    'error': 'Invalid or expired download token',
+                    'success': False
+                }), 400
+            extract_result = {'audio_url': token_data['u'], 'title': token_data['t'], 'success': True}
+            url = None
 
-        # First, extract the audio URL
-        extract_result = extract_audio_info(url, format_preference)
+        else:
+            # Get URL parameter
+            url = request.args.get('url')
+            if not url:
+                return jsonify({
+                    'error': 'Missing required parameter: url',
+                    'success': False
+                }), 400
 
-        if not extract_result.get('success'):
-            return jsonify(extract_result), 500
+            # Validate YouTube URL
+            if not is_valid_youtube_url(url):
+                return jsonify({
+                    'error': 'Invalid YouTube URL provided',
+                    'success': False
+                }), 400
+
+            # First, extract the audio URL
+            extract_result = extract_audio_info(url, format_preference)
+
+            if not extract_result.get('success'):
+                return jsonify(extract_result), 500
 
         audio_url = extract_result['audio_url']
         title = extract_result.get('title', 'audio')
 
-        # Sanitize filename
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-        if not safe_title:
-            safe_title = "audio"
-
-        filename = f"{safe_title}.{format_preference}"
-
-        logger.info(f"Downloading audio from: {audio_url[:100]}...")
-
-        # Enhanced headers for downloading from YouTube
-        download_headers = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'identity',  # Disable compression for streaming
-            'Connection': 'keep-alive',
-            'Referer': 'https://www.youtube.com/',
-            'Origin': 'https://www.youtube.com',
-            'Sec-Fetch-Dest': 'video',
-            'Sec-Fetch-Mode': 'no-cors',
-            'Sec-Fetch-Site': 'cross-site',
-            'Range': 'bytes=0-',  # Request range to enable streaming
+        logger.debug("Downloading audio from: %.100s...", audio_url)
+
+        # Forward the client's Range header so partial downloads can resume
+        # without re-extracting, and its Accept-Encoding since the body is
+        # relayed undecoded (identity if the client did not say)
+        range_header = request.headers.get('Range')
+        upstream_headers = {
+            **STREAM_DOWNLOAD_HEADERS,
+            'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity'),
         }
+        if range_header:
+            upstream_headers['Range'] = range_header
+
+        # Open the upstream stream now rather than on the first read, so the
+        # connection is already established when the response starts and
+        # upstream failures surface as a proper error status
+        try:
+            upstream = http_session.get(audio_url, headers=upstream_headers, stream=True, timeout=(5, 30))
+            upstream.raise_for_status()
+        except Exception as e:
+            logger.error(f"Failed to open upstream audio stream: {str(e)}")
+            # A stale signed URL must not be served from the cache again
+            forget_rejected_extraction(url, e)
+            return jsonify({
+                'error': f'Failed to download audio: {str(e)}',
+                'success': False
+            }), 502
 
         # Stream the audio file from YouTube to the client
         def generate():
             try:
-                with requests.get(audio_url, headers=download_headers, stream=True, timeout=30) as r:
-                    r.raise_for_status()
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            yield chunk
+                with upstream:
+                    # Relay urllib3's raw chunks as-is, skipping requests' iter_content
+                    # wrapper and any decoding; a Content-Encoding is passed through
+                    yield from upstream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
             except Exception as e:
+                # Headers are already sent, so abort the connection rather than
+                # ending the body cleanly; the client then sees a failed transfer
                 logger.error(f"Error streaming audio: {str(e)}")
-                yield b''  # End stream on error
+                raise
 
         # Determine content type
         content_type = 'audio/mp4' if format_preference == 'm4a' else 'audio/webm'
 
-        # Return streaming response
-        response = Response(
-            stream_with_context(generate()),
+        response_headers = {
+            'Content-Disposition': attachment_disposition(title, format_preference),
+            'Cache-Control': 'no-cache, no-transform',
+            'X-Accel-Buffering': 'no',
+            'X-Content-Type-Options': 'nosniff',
+            'Accept-Ranges': 'bytes',
+        }
+
+        # Pass through the upstream length so clients can show progress, and
+        # any encoding so the client decodes the relayed bytes itself
+        content_length = upstream.headers.get('Content-Length')
+        if content_length:
+            response_headers['Content-Length'] = content_length
+        content_encoding = upstream.headers.get('Content-Encoding')
+        if content_encoding:
+            response_headers['Content-Encoding'] = content_encoding
+
+        # Partial content for ranged requests
+        status = 200
+        if range_header and upstream.status_code == 206:
+            status = 206
+            if upstream.headers.get('Content-Range'):
+                response_headers['Content-Range'] = upstream.headers['Content-Range']
+
+        # Return streaming response. The body needs no request context and is
+        # handed to the server untouched; closing it releases the upstream
+        # connection even if it is never iterated
+        return Response(
+            ClosingIterator(generate(), upstream.close),
+            status=status,
             content_type=content_type,
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"',
-                'Cache-Control': 'no-cache',
-                'X-Content-Type-Options': 'nosniff',
-                'Accept-Ranges': 'bytes',
-            }
+            headers=response_headers,
+            direct_passthrough=True
         )
 
-        return response
-
     except Exception as e:
         logger.error(f"Unexpected error in /download endpoint: {str(e)}")
         return jsonify({
@@ -309,70 +957,215 @@ def download_audio():
             'success': False
         }), 500
 
-def segment_audio_for_processing(input_file, temp_dir, max_segment_duration=600):
-    """Split audio into 10-minute segments for Railway timeout handling"""
+# Concurrent ffmpeg processes per worker; each transcode keeps a core busy,
+# so more than the machine has only slows every request down
+FFMPEG_CONCURRENCY = int(os.environ.get('FFMPEG_CONCURRENCY', os.cpu_count() or 2))
+FFMPEG_SLOT_TIMEOUT = float(os.environ.get('FFMPEG_SLOT_TIMEOUT', 30))
+ffmpeg_semaphore = threading.BoundedSemaphore(FFMPEG_CONCURRENCY)
+
+def acquire_ffmpeg_slot(timeout=FFMPEG_SLOT_TIMEOUT):
+    """Wait for a free ffmpeg slot, raising a 'Server busy' error if none frees up in time"""
+    if not ffmpeg_semaphore.acquire(timeout=timeout):
+        raise Exception(f"Server busy: all {FFMPEG_CONCURRENCY} ffmpeg slots in use")
+
+@contextmanager
+def ffmpeg_slot(timeout=FFMPEG_SLOT_TIMEOUT):
+    """Hold an ffmpeg slot for the duration of the block"""
+    acquire_ffmpeg_slot(timeout)
     try:
-        # Get audio duration first
-        probe_cmd = [
-            'ffprobe',
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_format',
-            input_file
-        ]
-
-        result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=30)
-        if result.returncode != 0:
-            raise Exception(f"Failed to probe audio duration: {result.stderr}")
-
-        import json
-        probe_data = json.loads(result.stdout)
-        total_duration = float(probe_data['format']['duration'])
+        yield
+    finally:
+        ffmpeg_semaphore.release()
+
+class ProcessError(Exception):
+    """A /process failure, carrying the status code and JSON body to answer it with"""
+
+    def __init__(self, status, payload, headers=None):
+        super().__init__(payload.get('error'))
+        self.status = status
+        self.payload = payload
+        self.headers = headers or {}
+
+    def response(self):
+        """Flask response for the failure"""
+        return jsonify(self.payload), self.status, self.headers
+
+def server_busy_error(error_msg):
+    """503 telling the client to retry once an ffmpeg slot is likely free"""
+    logger.warning(error_msg)
+    return ProcessError(503, {
+        'error': 'Server is busy processing other audio, please retry shortly',
+        'success': False
+    }, {'Retry-After': str(int(FFMPEG_SLOT_TIMEOUT))})
+
+def file_too_large_error(size_mb):
+    """413 for audio above the 500MB processing limit"""
+    logger.warning("File too large for Railway processing: %.1fMB", size_mb)
+    return ProcessError(413, {  # Payload Too Large
+        'error': f'File too large for processing: {size_mb:.1f}MB (max 500MB)',
+        'success': False,
+        'suggestion': 'Use shorter videos or lower quality audio for Whisper'
+    })
 
-        logger.info(f"Audio duration: {total_duration:.1f}s, splitting into {max_segment_duration}s segments")
+class TempDirFile(io.FileIO):
+    """Read-only file that deletes its temp directory when closed.
+
+    The server closes the file once it has been sent (or the client has
+    gone away), which is the only hook left when the response body is a
+    wsgi.file_wrapper.
+    """
+
+    def __init__(self, path, temp_dir):
+        super().__init__(path, 'rb')
+        self.temp_dir = temp_dir
+
+    def close(self):
+        super().close()
+        remove_work_dir(self.temp_dir)
+
+# ffmpeg prefix for every transcode: only errors reach stderr, and no
+# progress lines are written into the captured pipe
+FFMPEG_CMD = ('ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-nostdin')
+
+# Large /process downloads are fetched as this many concurrent byte ranges
+PARALLEL_DOWNLOAD_PARTS = int(os.environ.get('PARALLEL_DOWNLOAD_PARTS', 4))
+download_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='range-fetch')
+
+def download_ranges_to_file(url, path, total_size, parts=PARALLEL_DOWNLOAD_PARTS):
+    """Download url into path as concurrent byte ranges; False if the server ignores Range"""
+    part_size = -(-total_size // parts)
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    fd = os.open(path, os.O_WRONLY)
+
+    def fetch(start):
+        end = min(start + part_size, total_size) - 1
+        headers = {**PROCESS_DOWNLOAD_HEADERS, 'Range': f'bytes={start}-{end}'}
+        with http_session.get(url, headers=headers, stream=True, timeout=(5, 120)) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                return False
+            offset = start
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        if offset != end + 1:
+            raise Exception(f"Incomplete range {start}-{end}: got {offset - start} bytes")
+        return True
 
-        # Calculate number of segments needed
-        num_segments = int(total_duration / max_segment_duration) + 1
-        segments = []
-
-        for i in range(num_segments):
-            start_time = i * max_segment_duration
-            segment_file = os.path.join(temp_dir, f'segment_{i:03d}.m4a')
+    try:
+        futures = [download_executor.submit(fetch, start) for start in range(0, total_size, part_size)]
+        futures_wait(futures)
+        return all(future.result() for future in futures)
+    finally:
+        os.close(fd)
+
+# RAM-backed directory for /process work files when it has room for them;
+# an empty value keeps everything on disk
+TMPFS_DIR = os.environ.get('TMPFS_DIR', '/dev/shm')
+
+# Bytes of TMPFS_DIR promised to work directories still in use in this
+# worker. Free space alone is not enough: requests that start together would
+# all see the same free RAM before any of them has written to it.
+tmpfs_reserved = {}
+tmpfs_lock = threading.Lock()
+
+def make_work_dir(expected_size, headroom=3):
+    """Create a temp directory, in TMPFS_DIR if it has headroom times expected_size free.
+
+    The space is reserved until remove_work_dir() is called, so concurrent
+    requests cannot overcommit the tmpfs. Bytes already written to a reserved
+    directory count twice (once as used, once as reserved), which errs on
+    the side of using disk.
+    """
+    if TMPFS_DIR and expected_size and os.path.isdir(TMPFS_DIR):
+        needed = expected_size * headroom
+        try:
+            with tmpfs_lock:
+                stat = os.statvfs(TMPFS_DIR)
+                if stat.f_bavail * stat.f_frsize - sum(tmpfs_reserved.values()) > needed:
+                    path = tempfile.mkdtemp(dir=TMPFS_DIR)
+                    tmpfs_reserved[path] = needed
+                    return path
+        except OSError as e:
+            logger.warning("Cannot use %s for temp files: %s", TMPFS_DIR, e)
+    # Unknown size or not enough room in RAM: fall back to disk
+    return tempfile.mkdtemp()
+
+def remove_work_dir(path):
+    """Delete a make_work_dir() directory and release its tmpfs reservation"""
+    shutil.rmtree(path, ignore_errors=True)
+    with tmpfs_lock:
+        tmpfs_reserved.pop(path, None)
+
+def download_audio_to_file(audio_url, path, content_length=0, upstream=None):
+    """Download audio_url into path, reusing an already opened upstream response; returns the size"""
+    if content_length and PARALLEL_DOWNLOAD_PARTS > 1 and hasattr(os, 'pwrite'):
+        # Several ranged connections together outrun one throttled stream
+        if upstream is not None:
+            upstream.close()
+            upstream = None
+        if download_ranges_to_file(audio_url, path, content_length):
+            return content_length
+        logger.info("Server ignored Range requests, downloading as a single stream")
+
+    if upstream is None:
+        upstream = http_session.get(audio_url, headers=PROCESS_DOWNLOAD_HEADERS, stream=True, timeout=(5, 120))
+        upstream.raise_for_status()
+
+    with upstream as response:
+        # Copy the raw stream straight into the file; urllib3
+        # still decodes any Content-Encoding
+        response.raw.decode_content = True
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(response.raw, f, STREAM_CHUNK_SIZE)
+            return f.tell()
 
-            # Create segment with FFmpeg
-            segment_cmd = [
-                'ffmpeg',
-                '-i', input_file,
-                '-ss', str(start_time),
-                '-t', str(max_segment_duration),
-                '-c', 'copy',  # Fast copy without re-encoding
-                '-avoid_negative_ts', 'make_zero',
-                '-y',
-                segment_file
-            ]
+def segment_audio_for_processing(input_file, temp_dir, max_segment_duration=600):
+    """Split audio into 10-minute segments for Railway timeout handling"""
+    try:
+        logger.info(f"Splitting audio into {max_segment_duration}s segments")
 
-            logger.info(f"Creating segment {i+1}/{num_segments}: {start_time}s-{start_time+max_segment_duration}s")
+        # One pass with the segment muxer writes every segment, instead of
+        # re-opening and seeking the input once per segment
+        segment_pattern = os.path.join(temp_dir, 'segment_%03d.m4a')
+        segment_cmd = [
+            *FFMPEG_CMD,
+            '-i', input_file,
+            '-vn',
+            '-map', '0:a',
+            '-c', 'copy',  # Fast copy without re-encoding
+            '-f', 'segment',
+            '-segment_time', str(max_segment_duration),
+            '-reset_timestamps', '1',
+            '-y',
+            segment_pattern
+        ]
 
+        with ffmpeg_slot():
             result = subprocess.run(
                 segment_cmd,
                 capture_output=True,
                 text=True,
-                timeout=60,
+                timeout=180,
                 creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
             )
 
-            if result.returncode != 0:
-                logger.warning(f"Segment {i} creation failed: {result.stderr}")
-                continue
+        if result.returncode != 0:
+            logger.warning(f"Segmentation reported an error: {result.stderr}")
+
+        segments = []
+        for i, segment_name in enumerate(sorted(name for name in os.listdir(temp_dir) if name.startswith('segment_'))):
+            segment_file = os.path.join(temp_dir, segment_name)
 
-            # Check if segment file was created and has content
-            if os.path.exists(segment_file) and os.path.getsize(segment_file) > 1024:
-                segment_size = os.path.getsize(segment_file) / (1024*1024)
+            # Check if segment file has content
+            segment_bytes = os.path.getsize(segment_file)
+            if segment_bytes > 1024:
+                segment_size = segment_bytes / (1024*1024)
                 segments.append({
                     'file': segment_file,
                     'index': i,
-                    'start_time': start_time,
-                    'duration': min(max_segment_duration, total_duration - start_time),
+                    'start_time': i * max_segment_duration,
                     'size_mb': segment_size
                 })
                 logger.info(f"Segment {i} created: {segment_size:.1f}MB")
@@ -386,28 +1179,29 @@ def segment_audio_for_processing(input_file, temp_dir, max_segment_duration=600)
         logger.error(f"Audio segmentation failed: {str(e)}")
         raise Exception(f"Failed to segment audio: {str(e)}")
 
+def segment_compression_settings(size_mb):
+    """Pick (bitrate, sample rate) for compressing a 10-minute segment of the given size"""
+    # Use aggressive settings for segments (they're smaller)
+    if size_mb > 50:
+        return '16k', '8000'
+    elif size_mb > 20:
+        return '24k', '11025'
+    return '32k', '16000'
+
 def compress_segment_for_whisper(segment_info, output_file):
     """Compress a single audio segment for Whisper with fast settings"""
     try:
         input_file = segment_info['file']
         size_mb = segment_info['size_mb']
 
-        # Use aggressive settings for segments (they're smaller)
-        if size_mb > 50:
-            bitrate = '16k'
-            sample_rate = '8000'
-        elif size_mb > 20:
-            bitrate = '24k'
-            sample_rate = '11025'
-        else:
-            bitrate = '32k'
-            sample_rate = '16000'
+        bitrate, sample_rate = segment_compression_settings(size_mb)
 
         logger.info(f"Compressing segment {segment_info['index']}: {size_mb:.1f}MB with {bitrate} bitrate")
 
         cmd = [
-            'ffmpeg',
+            *FFMPEG_CMD,
             '-i', input_file,
+            '-vn',
             '-c:a', 'aac',
             '-b:a', bitrate,
             '-ac', '1',                  # Mono
@@ -415,6 +1209,7 @@ def compress_segment_for_whisper(segment_info, output_file):
             '-threads', '1',             # Single thread per segment
             '-preset', 'ultrafast',
             '-profile:a', 'aac_low',
+            '-aac_coder', 'fast',
             '-map_metadata', '-1',
             '-movflags', '+faststart',
             '-f', 'mp4',
@@ -422,13 +1217,14 @@ def compress_segment_for_whisper(segment_info, output_file):
             output_file
         ]
 
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=120,  # Short timeout per segment
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        )
+        with ffmpeg_slot():
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                text=True,
+                timeout=120,  # Short timeout per segment
+                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+            )
 
         if result.returncode != 0:
             raise Exception(f"Segment compression failed: {result.stderr}")
@@ -448,50 +1244,304 @@ def compress_segment_for_whisper(segment_info, output_file):
         logger.error(f"Segment compression error: {str(e)}")
         raise Exception(f"Failed to compress segment: {str(e)}")
 
-def compress_audio_for_whisper(input_file, output_file, original_size_mb):
+def whisper_compression_settings(original_size_mb):
+    """Pick (bitrate, sample rate, timeout) for compressing a file of the given size"""
+    # Ultra-aggressive settings optimized for Railway's 600s timeout
+    if original_size_mb > 300:
+        # Extreme files: immediate ultra-low quality
+        bitrate = '12k'
+        sample_rate = '8000'
+        timeout = 90  # Very short timeout
+    elif original_size_mb > 200:
+        # Very large files: aggressive compression
+        bitrate = '16k'
+        sample_rate = '8000'
+        timeout = 120
+    elif original_size_mb > 100:
+        # Large files: fast compression
+        bitrate = '24k'
+        sample_rate = '11025'
+        timeout = 150
+    else:
+        # Smaller files: still fast but better quality
+        bitrate = '32k'
+        sample_rate = '16000'
+        timeout = 120
+    return bitrate, sample_rate, timeout
+
+# Whisper rejects uploads above 25MB. Streamed output is budgeted to a
+# fraction of that, leaving room for container overhead and the encoder
+# overshooting its target bitrate.
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+WHISPER_BUDGET_FRACTION = 0.9
+
+# (bitrate, sample rate) steps from best to smallest; libopus only takes
+# 8/12/16/24/48kHz input
+AAC_BITRATE_TIERS = (('32k', '16000'), ('24k', '11025'), ('16k', '8000'), ('12k', '8000'), ('8k', '8000'))
+OPUS_BITRATE_TIERS = (('16k', '16000'), ('12k', '16000'), ('8k', '8000'))
+
+def process_compression_settings(size_mb, duration, codec='aac'):
+    """Pick (bitrate, sample rate, timeout, max duration) for /process; large files keep only their first 10 minutes.
+
+    The size of the download picks a starting tier; the audio's duration
+    then lowers the bitrate until the encoded length fits the Whisper
+    budget. Without a duration only the size is used.
+    """
+    if size_mb <= 100:
+        bitrate, sample_rate, timeout = whisper_compression_settings(size_mb)
+        max_duration = None
+    else:
+        # Settings are chosen for the size of the 10-minute slice actually encoded
+        segment_mb = size_mb * min(1, 600 / duration) if duration else size_mb
+        bitrate, sample_rate = segment_compression_settings(segment_mb)
+        timeout = 120
+        max_duration = 600
+    if codec == 'opus':
+        # 16kbps Opus is already below every AAC tier
+        tiers = OPUS_BITRATE_TIERS
+    else:
+        tiers = AAC_BITRATE_TIERS[[tier[0] for tier in AAC_BITRATE_TIERS].index(bitrate):]
+    if duration:
+        seconds = min(duration, max_duration or duration)
+        budget_bps = WHISPER_MAX_BYTES * WHISPER_BUDGET_FRACTION * 8 / seconds
+        # The last tier is used even if it does not fit; the stream then
+        # fails once it passes the limit
+        tiers = [tier for tier in tiers[:-1] if int(tier[0][:-1]) * 1000 <= budget_bps] or tiers[-1:]
+    bitrate, sample_rate = tiers[0]
+    return bitrate, sample_rate, timeout, max_duration
+
+def mp4_index_first(head):
+    """False if the MP4 boxes in head show media data before the index, which a pipe cannot seek back to"""
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            # Not an MP4 box layout (e.g. WebM)
+            return True
+        offset += size
+    return True
+
+def stream_compress_for_whisper(source, bitrate, sample_rate, timeout, max_duration=None, codec='aac',
+                                slot_timeout=FFMPEG_SLOT_TIMEOUT):
+    """Compress a download through ffmpeg and return an iterator of the compressed audio as it is encoded.
+
+    source is either a streaming upstream response, piped into ffmpeg as it
+    arrives, or the path of an already downloaded file. With max_duration,
+    ffmpeg stops after that many seconds of audio and the rest of a piped
+    download is never fetched. codec is a WHISPER_CODECS key.
+
+    timeout is how long ffmpeg may go without progress: no input fed from
+    the download and no output read for the client. A slow but moving
+    download or client never trips it; a stalled one does. Waiting for an
+    ffmpeg slot (up to slot_timeout) comes before it and does not count.
+    """
+
+    if isinstance(source, str):
+        upstream = None
+        input_arg = source
+    else:
+        upstream = source
+        input_arg = 'pipe:0'
+        chunks = upstream.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        try:
+            head = next(chunks, b'')
+        except Exception:
+            # e.g. a reset connection; the pooled connection must still go
+            upstream.close()
+            raise
+        if not mp4_index_first(head):
+            upstream.close()
+            raise Exception("MP4 index is at the end of the file")
+
+    def close_upstream():
+        if upstream is not None:
+            upstream.close()
+
+    if codec == 'opus':
+        # Ogg is written front to back, so it streams as is. The lowest
+        # complexity encodes ~4x faster than libopus' default at the same size
+        encoder = ('-c:a', 'libopus', '-application', 'voip', '-vbr', 'on', '-compression_level', '0', '-f', 'ogg')
+    else:
+        encoder = (
+            '-c:a', 'aac',
+            '-profile:a', 'aac_low',
+            '-aac_coder', 'fast',
+            # Fragmented MP4 can be written without seeking back to the header.
+            # Audio has no keyframes to cut on, so fragments are cut every 2s;
+            # otherwise the whole encode arrives as one fragment at the end
+            '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+            '-frag_duration', '2000000',
+            '-f', 'mp4',
+        )
+
+    cmd = [
+        *FFMPEG_CMD,
+        '-i', input_arg,
+        '-vn',
+        '-b:a', bitrate,
+        '-ac', '1',
+        '-ar', sample_rate,
+        '-threads', '1',  # One core per ffmpeg slot
+        '-map_metadata', '-1',
+        *(('-t', str(max_duration)) if max_duration else ()),
+        *encoder,
+        'pipe:1'
+    ]
+
+    try:
+        acquire_ffmpeg_slot(slot_timeout)
+    except Exception:
+        close_upstream()
+        raise
+    slot_held = True
+
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL if upstream is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        )
+    except Exception:
+        ffmpeg_semaphore.release()
+        stderr_file.close()
+        close_upstream()
+        raise
+
+    last_progress = time.monotonic()
+
+    def pump():
+        nonlocal last_progress
+        try:
+            proc.stdin.write(head)
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+                last_progress = time.monotonic()
+        except (BrokenPipeError, ValueError):
+            # ffmpeg exited early; the reader reports why
+            pass
+        except Exception as e:
+            logger.error("Error feeding audio to ffmpeg: %s", e)
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    timed_out = threading.Event()
+    finished = threading.Event()
+
+    def watch():
+        while not finished.wait(min(1, timeout)):
+            if time.monotonic() - last_progress > timeout:
+                # Killing ffmpeg gives a blocked stdout read EOF, so the
+                # reader notices even when no output is flowing
+                timed_out.set()
+                if proc.poll() is None:
+                    proc.kill()
+                return
+
+    watchdog = threading.Thread(target=watch, name='ffmpeg-watchdog', daemon=True)
+
+    def stop():
+        nonlocal slot_held
+        finished.set()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        close_upstream()
+        stderr_file.close()
+        # stop() runs from both the generator and the response close
+        if slot_held:
+            slot_held = False
+            ffmpeg_semaphore.release()
+
+    def ffmpeg_error():
+        if timed_out.is_set():
+            return f"Audio compression timed out: no progress for {timeout} seconds"
+        stderr_file.seek(0)
+        return f"Streaming compression failed: {stderr_file.read()[-500:].decode('utf-8', 'replace')}"
+
+    watchdog.start()
+    if upstream is not None:
+        threading.Thread(target=pump, name='ffmpeg-feed', daemon=True).start()
+
+    # Wait for the first output so a bad input still gets a proper error response
+    try:
+        first = proc.stdout.read1(STREAM_CHUNK_SIZE)
+        if not first:
+            proc.wait()
+            raise Exception(ffmpeg_error())
+    except Exception:
+        stop()
+        raise
+    last_progress = time.monotonic()
+
+    def generate():
+        nonlocal last_progress
+        sent = len(first)
+        try:
+            yield first
+            while True:
+                chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                last_progress = time.monotonic()
+                sent += len(chunk)
+                if sent > WHISPER_MAX_BYTES:
+                    # Whisper would reject the file; fail the transfer (and
+                    # with it the cache entry) instead of finishing it
+                    raise Exception(f"File still too large: streamed output passed {WHISPER_MAX_BYTES // (1024*1024)}MB")
+                yield chunk
+            if proc.wait() != 0 or timed_out.is_set():
+                raise Exception(ffmpeg_error())
+            logger.info("Streamed %.2fMB of compressed audio", sent / (1024*1024))
+        except Exception as e:
+            # Abort the connection so the client sees a failed transfer
+            logger.error("Error streaming compressed audio: %s", e)
+            raise
+        finally:
+            stop()
+
+    # Closing releases ffmpeg and the download even if the body is never iterated
+    return ClosingIterator(generate(), stop)
+
+def compress_audio_for_whisper(input_file, output_file, original_size_mb, slot_timeout=FFMPEG_SLOT_TIMEOUT):
     """Compress audio file to be under 25MB for OpenAI Whisper with Railway-optimized speed"""
     try:
         # Early validation: don't compress files already under 25MB
         if original_size_mb < 25:
             logger.info(f"File already under 25MB ({original_size_mb:.2f}MB), no compression needed")
-            # Copy file without compression
-            shutil.copy2(input_file, output_file)
+            # copyfile moves the bytes in-kernel; copy2's stat copy isn't needed
+            shutil.copyfile(input_file, output_file)
             return os.path.getsize(output_file)
-        # Ultra-aggressive settings optimized for Railway's 600s timeout
-        if original_size_mb > 300:
-            # Extreme files: immediate ultra-low quality
-            bitrate = '12k'
-            sample_rate = '8000'
-            timeout = 90  # Very short timeout
-        elif original_size_mb > 200:
-            # Very large files: aggressive compression
-            bitrate = '16k'
-            sample_rate = '8000'
-            timeout = 120
-        elif original_size_mb > 100:
-            # Large files: fast compression
-            bitrate = '24k'
-            sample_rate = '11025'
-            timeout = 150
-        else:
-            # Smaller files: still fast but better quality
-            bitrate = '32k'
-            sample_rate = '16000'
-            timeout = 120
+        bitrate, sample_rate, timeout = whisper_compression_settings(original_size_mb)
 
         logger.info(f"Railway-optimized compression: {bitrate} bitrate, {sample_rate}Hz for {original_size_mb:.1f}MB file")
 
         # Railway-optimized FFmpeg command with maximum speed
         cmd = [
-            'ffmpeg',
+            *FFMPEG_CMD,
             '-i', input_file,
+            '-vn',
             '-c:a', 'aac',               # AAC codec (fastest)
             '-b:a', bitrate,             # Ultra-low bitrate
             '-ac', '1',                  # Mono (cuts size in half)
             '-ar', sample_rate,          # Low sample rate for speed
-            '-threads', '2',             # Match Railway worker cores
+            '-threads', '1',             # One core per ffmpeg slot
             '-preset', 'ultrafast',      # Fastest preset always
             '-profile:a', 'aac_low',     # Low complexity profile
+            '-aac_coder', 'fast',        # ~25% less encoder CPU than twoloop
             '-avoid_negative_ts', 'make_zero',
             '-shortest',                 # Stop at shortest stream
             '-map_metadata', '-1',       # Strip all metadata
@@ -504,13 +1554,14 @@ def compress_audio_for_whisper(input_file, output_file, original_size_mb):
         logger.info(f"Railway compression command: {' '.join(cmd[:8])}...")  # Log truncated command
 
         # Run with strict timeout
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        )
+        with ffmpeg_slot(slot_timeout):
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+            )
 
         if result.returncode != 0:
             # Emergency fallback: absolute minimum quality for Railway
@@ -518,8 +1569,9 @@ def compress_audio_for_whisper(input_file, output_file, original_size_mb):
             logger.info("Trying emergency Railway-survival mode...")
 
             cmd_emergency = [
-                'ffmpeg',
+                *FFMPEG_CMD,
                 '-i', input_file,
+                '-vn',
                 '-c:a', 'aac',
                 '-b:a', '8k',            # Absolute minimum
                 '-ac', '1',              # Mono
@@ -527,6 +1579,7 @@ def compress_audio_for_whisper(input_file, output_file, original_size_mb):
                 '-threads', '1',         # Single thread for stability
                 '-preset', 'ultrafast',
                 '-profile:a', 'aac_low',
+                '-aac_coder', 'fast',
                 '-t', '600',             # Limit to 10 minutes max
                 '-map_metadata', '-1',
                 '-f', 'mp4',
@@ -534,13 +1587,14 @@ def compress_audio_for_whisper(input_file, output_file, original_size_mb):
                 output_file
             ]
 
-            result = subprocess.run(
-                cmd_emergency,
-                capture_output=True,
-                text=True,
-                timeout=45,  # Ultra-short emergency timeout
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-            )
+            with ffmpeg_slot(slot_timeout):
+                result = subprocess.run(
+                    cmd_emergency,
+                    capture_output=True,
+                    text=True,
+                    timeout=45,  # Ultra-short emergency timeout
+                    creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+                )
 
             if result.returncode != 0:
                 raise Exception(f"Emergency Railway compression failed: {result.stderr}")
@@ -568,219 +1622,683 @@ def compress_audio_for_whisper(input_file, output_file, original_size_mb):
         logger.error(f"Compression error: {str(e)}")
         raise Exception(f"Audio compression failed: {str(e)}")
 
-@app.route('/process', methods=['GET'])
-def process_audio():
-    """Complete pipeline: extract YouTube audio, compress for Whisper (<25MB), and stream binary"""
-    temp_dir = None
+# Finished /process outputs keyed by video ID, so repeat requests skip the
+# download and ffmpeg entirely. Oldest entries are evicted past the size
+# budget; PROCESS_CACHE_MAX_MB=0 disables the cache.
+PROCESS_CACHE_DIR = os.environ.get('PROCESS_CACHE_DIR', os.path.join(YTDLP_CACHE_DIR, 'whisper'))
+PROCESS_CACHE_TTL = int(os.environ.get('PROCESS_CACHE_TTL', 7 * 86400))
+PROCESS_CACHE_MAX_BYTES = int(os.environ.get('PROCESS_CACHE_MAX_MB', 2048)) * 1024 * 1024
+if PROCESS_CACHE_MAX_BYTES:
     try:
-        # Get URL parameter
-        url = request.args.get('url')
-        if not url:
-            return jsonify({
-                'error': 'Missing required parameter: url',
-                'success': False
-            }), 400
+        os.makedirs(PROCESS_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning("Process cache disabled, cannot create %s: %s", PROCESS_CACHE_DIR, e)
+        PROCESS_CACHE_MAX_BYTES = 0
+
+def process_cache_path(video_id, codec='aac'):
+    """Path of the cached /process output for a video"""
+    return os.path.join(PROCESS_CACHE_DIR, f"{video_id}.whisper.{WHISPER_CODECS[codec]['ext']}")
+
+def process_cache_get(video_id, codec='aac'):
+    """Path of a fresh cached /process output, or None"""
+    if not PROCESS_CACHE_MAX_BYTES or not video_id:
+        return None
+    path = process_cache_path(video_id, codec)
+    try:
+        if time.time() - os.stat(path).st_mtime < PROCESS_CACHE_TTL:
+            return path
+    except OSError:
+        pass
+    return None
 
-        # Validate YouTube URL
-        if not is_valid_youtube_url(url):
-            return jsonify({
-                'error': 'Invalid YouTube URL provided',
-                'success': False
-            }), 400
+PROCESS_CACHE_SUFFIXES = tuple(f".whisper.{fmt['ext']}" for fmt in WHISPER_CODECS.values())
 
-        logger.info(f"Processing audio for Whisper optimization: {url}")
+def process_cache_prune():
+    """Evict expired entries, then the oldest ones until the cache fits its budget"""
+    entries = []
+    try:
+        for entry in os.scandir(PROCESS_CACHE_DIR):
+            if entry.name.endswith(PROCESS_CACHE_SUFFIXES):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith('.job') and time.time() - entry.stat().st_mtime > PROCESS_CACHE_TTL:
+                # Markers left by failed background jobs
+                os.remove(entry.path)
+    except OSError as e:
+        logger.warning("Failed to scan process cache: %s", e)
+        return
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    expired_before = time.time() - PROCESS_CACHE_TTL
+    for mtime, size, path in entries:
+        if mtime >= expired_before and total <= PROCESS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def process_cache_store(video_id, chunks, codec='aac'):
+    """Yield chunks while copying them into the process cache.
+
+    The entry is published atomically, and only if the whole stream was
+    produced; a failed or abandoned stream leaves nothing behind.
+    """
+    if not PROCESS_CACHE_MAX_BYTES or not video_id:
+        yield from chunks
+        return
+
+    path = process_cache_path(video_id, codec)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        cache_file = open(tmp_path, 'wb')
+    except OSError as e:
+        logger.warning("Cannot write process cache entry: %s", e)
+        yield from chunks
+        return
 
+    completed = False
+    try:
+        for chunk in chunks:
+            if cache_file:
+                try:
+                    cache_file.write(chunk)
+                except OSError as e:
+                    # e.g. disk full; keep streaming without caching
+                    logger.warning("Stopped writing process cache entry: %s", e)
+                    cache_file.close()
+                    cache_file = None
+            yield chunk
+        completed = cache_file is not None
+    finally:
+        if cache_file:
+            cache_file.close()
+        if completed:
+            os.replace(tmp_path, path)
+            process_cache_prune()
+        else:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def process_cache_store_file(video_id, source):
+    """Copy a finished /process output file into the cache"""
+    if not PROCESS_CACHE_MAX_BYTES or not video_id:
+        return
+    path = process_cache_path(video_id)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Cannot write process cache entry: %s", e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+    process_cache_prune()
+
+def file_response(output_file, content_type, headers):
+    """Send an open file with sendfile() where the server supports it, answering Range requests with 206"""
+    size = os.fstat(output_file.fileno()).st_size
+    response = Response(
+        wrap_file(request.environ, output_file, STREAM_CHUNK_SIZE),
+        content_type=content_type,
+        headers={**headers, 'Content-Length': str(size)},
+        direct_passthrough=True
+    )
+    try:
+        return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable as e:
+        # Closing the file also releases a TempDirFile's directory
+        response.close()
+        return e.get_response()
+
+def cached_audio_response(path, codec='aac'):
+    """Send a cached /process output"""
+    output_format = WHISPER_CODECS[codec]
+    # Unbuffered like TempDirFile: reads are already chunk-sized when the
+    # server cannot use sendfile()
+    return file_response(io.FileIO(path, 'rb'), output_format['content_type'], output_format['headers'])
+
+def process_whisper_audio(url, video_id, codec='aac', slot_timeout=FFMPEG_SLOT_TIMEOUT):
+    """Extract, download and compress a video's audio for Whisper.
+
+    Returns (body, content_type, headers) where body is either an open
+    TempDirFile or a closeable iterator of chunks; consuming the body fills
+    the process cache. Raises ProcessError for anything the client should
+    hear about, including a 503 when no ffmpeg slot frees up within
+    slot_timeout seconds.
+    """
+    output_format = WHISPER_CODECS[codec]
+    temp_dir = None
+    try:
         # Extract audio information
         try:
             extract_result = extract_audio_info(url, 'm4a')
             if not extract_result.get('success'):
-                return jsonify(extract_result), 500
+                raise ProcessError(500, extract_result)
 
             audio_url = extract_result['audio_url']
             title = extract_result.get('title', 'audio')
 
             logger.info(f"Successfully extracted audio URL, now downloading and compressing...")
 
+        except ProcessError:
+            raise
         except Exception as e:
             logger.error(f"Failed to extract audio info: {str(e)}")
-            return jsonify({
+            raise ProcessError(500, {
                 'error': f'Failed to extract audio: {str(e)}',
                 'success': False
-            }), 500
+            })
+
+        # Open the download first; its length decides how the audio is processed
+        try:
+            logger.debug("Downloading audio from: %.100s...", audio_url)
+            upstream = http_session.get(audio_url, headers=PROCESS_DOWNLOAD_HEADERS, stream=True, timeout=(5, 120))
+            upstream.raise_for_status()
+        except Exception as e:
+            logger.error(f"Failed to download audio: {str(e)}")
+            forget_rejected_extraction(url, e)
+            raise ProcessError(500, {
+                'error': f'Failed to download audio: {str(e)}',
+                'success': False
+            })
+
+        content_length = int(upstream.headers.get('Content-Length') or 0)
+        expected_size_mb = content_length / (1024*1024)
+
+        if expected_size_mb > 500:
+            upstream.close()
+            raise file_too_large_error(expected_size_mb)
+
+        if content_length and expected_size_mb < 25 and codec == 'aac':
+            # Small enough already: relay the download without touching disk
+            logger.info(f"File already under 25MB ({expected_size_mb:.2f}MB), streaming through without compression")
+            return (
+                ClosingIterator(
+                    process_cache_store(video_id, upstream.iter_content(chunk_size=STREAM_CHUNK_SIZE)),
+                    upstream.close
+                ),
+                'audio/mp4',
+                {**PROCESS_RESPONSE_HEADERS, 'Content-Length': str(content_length)}
+            )
+
+        if content_length:
+            # Compress while downloading so the client gets bytes immediately
+            if expected_size_mb <= 100:
+                logger.info(f"Medium file ({expected_size_mb:.1f}MB), compressing while downloading")
+            else:
+                # The rest of the download is never fetched
+                logger.info(f"Large file ({expected_size_mb:.1f}MB), streaming the first 10 minutes")
+            bitrate, sample_rate, timeout, max_duration = process_compression_settings(
+                expected_size_mb, extract_result.get('duration'), codec)
+            try:
+                compressed = stream_compress_for_whisper(
+                    upstream, bitrate, sample_rate, timeout, max_duration, codec, slot_timeout)
+                return (
+                    ClosingIterator(process_cache_store(video_id, compressed, codec), compressed.close),
+                    output_format['content_type'],
+                    output_format['headers']
+                )
+            except Exception as e:
+                if str(e).startswith('Server busy'):
+                    raise server_busy_error(str(e))
+                # e.g. an MP4 whose index is at the end cannot be read from a pipe
+                logger.warning(f"Streaming compression unavailable, falling back to temp file: {str(e)}")
+                upstream.close()
+                upstream = None
 
         # Create temporary directory for processing
-        temp_dir = tempfile.mkdtemp()
+        temp_dir = make_work_dir(content_length, headroom=2)
         input_file = os.path.join(temp_dir, 'input.m4a')
         output_file = os.path.join(temp_dir, 'output.m4a')
 
         # Download audio file
         try:
-            logger.info(f"Downloading audio from: {audio_url[:100]}...")
-
-            download_headers = {
-                'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.210 Mobile Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Connection': 'keep-alive',
-                'Referer': 'https://www.youtube.com/',
-                'Origin': 'https://www.youtube.com',
-            }
-
-            with requests.get(audio_url, headers=download_headers, stream=True, timeout=120) as response:
-                response.raise_for_status()
-
-                original_size = 0
-                with open(input_file, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            original_size += len(chunk)
-
-                original_size_mb = original_size / (1024*1024)
-                logger.info(f"Downloaded {original_size_mb:.2f} MB original audio")
-
-                # Railway safety check: reject extremely large files upfront
-                if original_size_mb > 500:
-                    logger.warning(f"File too large for Railway processing: {original_size_mb:.1f}MB")
-                    return jsonify({
-                        'error': f'File too large for processing: {original_size_mb:.1f}MB (max 500MB)',
-                        'success': False,
-                        'suggestion': 'Use shorter videos or lower quality audio for Whisper'
-                    }), 413  # Payload Too Large
+            original_size = download_audio_to_file(audio_url, input_file, content_length, upstream)
+            upstream = None
+
+            original_size_mb = original_size / (1024*1024)
+            logger.info(f"Downloaded {original_size_mb:.2f} MB original audio")
 
         except Exception as e:
             logger.error(f"Failed to download audio: {str(e)}")
-            return jsonify({
+            forget_rejected_extraction(url, e)
+            raise ProcessError(500, {
                 'error': f'Failed to download audio: {str(e)}',
                 'success': False
-            }), 500
+            })
+
+        # Railway safety check: reject extremely large files upfront
+        if original_size_mb > 500:
+            raise file_too_large_error(original_size_mb)
 
-        # Process audio for Whisper with segmentation for large files
+        # Process audio for Whisper; encoded output is streamed from ffmpeg
+        # to the client while it is produced
+        compressed = None
         try:
             # Check if original file is already under 25MB - skip compression entirely
-            if original_size_mb < 25:
+            if original_size_mb < 25 and codec == 'aac':
                 logger.info(f"File already under 25MB ({original_size_mb:.2f}MB), skipping compression")
-                # Copy original file to output file for consistent response handling
-                shutil.copy2(input_file, output_file)
-                compressed_size = original_size
-                compressed_size_mb = original_size_mb
+                # Serve the download itself rather than copying it to output_file
+                output_file = input_file
                 logger.info(f"No compression needed: {original_size_mb:.2f}MB file passed through")
 
-            elif original_size_mb <= 100:
-                # Medium files: aggressive compression
-                logger.info(f"Medium file ({original_size_mb:.1f}MB), using aggressive compression")
-                compressed_size = compress_audio_for_whisper(input_file, output_file, original_size_mb)
-                compressed_size_mb = compressed_size / (1024*1024)
-                logger.info(f"Aggressive compression: {original_size_mb:.1f}MB → {compressed_size_mb:.2f}MB")
-
             else:
-                # Large files: segment and return first segment immediately
-                logger.info(f"Large file ({original_size_mb:.1f}MB), using segmentation for Railway timeout safety")
-
-                # Segment the audio into 10-minute chunks
-                segments = segment_audio_for_processing(input_file, temp_dir, max_segment_duration=600)
-
-                if not segments:
-                    raise Exception("Failed to create any audio segments")
-
-                # Process first segment immediately for quick response
-                first_segment = segments[0]
-                first_output = os.path.join(temp_dir, 'first_segment_compressed.m4a')
-
-                logger.info(f"Processing first segment ({first_segment['size_mb']:.1f}MB) for immediate response")
-                compressed_size = compress_segment_for_whisper(first_segment, first_output)
-
-                # Use first segment as the output
-                output_file = first_output
-                compressed_size_mb = compressed_size / (1024*1024)
-
-                logger.info(f"First segment ready: {first_segment['size_mb']:.1f}MB → {compressed_size_mb:.2f}MB")
-                logger.info(f"Note: Returning first 10 minutes of {len(segments)}-segment audio for Railway timeout safety")
+                if original_size_mb <= 100:
+                    logger.info(f"Medium file ({original_size_mb:.1f}MB), using aggressive compression")
+                else:
+                    logger.info(f"Large file ({original_size_mb:.1f}MB), streaming the first 10 minutes for Railway timeout safety")
+                bitrate, sample_rate, timeout, max_duration = process_compression_settings(
+                    original_size_mb, extract_result.get('duration'), codec)
+                try:
+                    compressed = stream_compress_for_whisper(
+                        input_file, bitrate, sample_rate, timeout, max_duration, codec, slot_timeout)
+                except Exception as e:
+                    # The file-based fallback only writes AAC
+                    if "server busy" in str(e).lower() or codec != 'aac':
+                        raise
+                    # Nothing has been sent yet, so the file-based path (with
+                    # its emergency low-quality retry) can still take over
+                    logger.warning(f"Streaming compression failed, compressing to a file: {str(e)}")
+                    compressed_size = compress_audio_for_whisper(input_file, output_file, original_size_mb, slot_timeout)
+                    logger.info(f"Aggressive compression: {original_size_mb:.1f}MB → {compressed_size / (1024*1024):.2f}MB")
 
         except Exception as e:
             error_msg = str(e)
             logger.error(f"Compression failed: {error_msg}")
 
             # Provide helpful error messages based on the failure type
-            if "timed out" in error_msg.lower():
-                return jsonify({
+            if "server busy" in error_msg.lower():
+                raise server_busy_error(error_msg)
+
+            elif "timed out" in error_msg.lower():
+                raise ProcessError(408, {  # Request Timeout
                     'error': f'Audio compression timed out. Original file size: {original_size_mb:.2f}MB. Try a shorter video.',
                     'success': False,
                     'original_size_mb': original_size_mb,
                     'suggestion': 'Use videos under 200MB for faster processing'
-                }), 408  # Request Timeout
-
-            elif "too large" in error_msg.lower():
-                # Only show this error if we actually attempted compression (file was >25MB)
-                if original_size_mb >= 25:
-                    return jsonify({
-                        'error': f'Compressed audio still exceeds 25MB limit after compression. Original: {original_size_mb:.2f}MB',
-                        'success': False,
-                        'original_size_mb': original_size_mb,
-                        'suggestion': 'Use shorter videos for Whisper transcription'
-                    }), 413  # Payload Too Large
-                else:
-                    # This shouldn't happen with our new logic, but handle gracefully
-                    return jsonify({
-                        'error': f'Unexpected compression error for small file ({original_size_mb:.2f}MB): {error_msg}',
-                        'success': False,
-                        'original_size_mb': original_size_mb
-                    }), 500
+                })
+
+            elif "still too large" in error_msg.lower():
+                # Only the AAC file fallback gets here; streamed output, and
+                # so every Opus encode, is checked as it is sent and aborts
+                # the transfer once it passes the limit
+                raise ProcessError(413, {  # Payload Too Large
+                    'error': f'Compressed audio still exceeds 25MB limit after compression. Original: {original_size_mb:.2f}MB',
+                    'success': False,
+                    'original_size_mb': original_size_mb,
+                    'suggestion': 'Use shorter videos for Whisper transcription'
+                })
 
             else:
-                return jsonify({
+                raise ProcessError(500, {
                     'error': f'Audio processing failed: {error_msg}. Original file size: {original_size_mb:.2f}MB',
                     'success': False,
                     'original_size_mb': original_size_mb
-                }), 500
+                })
 
-        # Stream the compressed audio file
-        def generate_compressed_stream():
-            try:
-                with open(output_file, 'rb') as f:
-                    while True:
-                        chunk = f.read(16384)  # 16KB chunks
-                        if not chunk:
-                            break
-                        yield chunk
-            except Exception as e:
-                logger.error(f"Error streaming compressed audio: {str(e)}")
-                yield b''
-            finally:
-                # Cleanup temp directory
-                if temp_dir and os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-
-        # Create response with Whisper-optimized audio
-        response = Response(
-            stream_with_context(generate_compressed_stream()),
-            content_type='audio/mp4',
-            headers={
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0',
-                'X-Content-Type-Options': 'nosniff',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'X-Audio-Compression': 'whisper-optimized',
-                'X-Audio-Bitrate': '64kbps',
-                'X-Audio-Format': 'm4a-mono-16khz',
-            }
-        )
+        if compressed is not None:
+            # The temp directory goes once ffmpeg's output has been sent
+            cleanup_dir = temp_dir
+            temp_dir = None
+            return (
+                ClosingIterator(
+                    process_cache_store(video_id, compressed, codec),
+                    [compressed.close, lambda: remove_work_dir(cleanup_dir)]
+                ),
+                output_format['content_type'],
+                output_format['headers']
+            )
 
-        return response
+        process_cache_store_file(video_id, output_file)
+
+        # Hand the compressed file to the server's wsgi.file_wrapper so it is
+        # sent with sendfile() instead of being copied through Python
+        output_stream = TempDirFile(output_file, temp_dir)
+        # The file now owns the temp directory
+        temp_dir = None
+        if hasattr(os, 'posix_fadvise'):
+            # Let the kernel read ahead so the file is served from the page cache
+            os.posix_fadvise(output_stream.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        return output_stream, 'audio/mp4', PROCESS_RESPONSE_HEADERS
+
+    finally:
+        # Every failure (413, 408, failed download or compression) ends up
+        # here with the directory still ours; a successful result has already
+        # handed it to the body being returned
+        if temp_dir:
+            remove_work_dir(temp_dir)
+
+@app.route('/process', methods=['GET'])
+def process_audio():
+    """Complete pipeline: extract YouTube audio, compress for Whisper (<25MB), and stream binary"""
+    try:
+        # Get URL parameter
+        url = request.args.get('url')
+        if not url:
+            return jsonify({
+                'error': 'Missing required parameter: url',
+                'success': False
+            }), 400
+
+        # Validate YouTube URL
+        if not is_valid_youtube_url(url):
+            return jsonify({
+                'error': 'Invalid YouTube URL provided',
+                'success': False
+            }), 400
+
+        codec = request.args.get('codec', 'aac').lower()
+        if codec not in WHISPER_CODECS:
+            return jsonify({
+                'error': f"Unsupported codec: {codec} (use {' or '.join(WHISPER_CODECS)})",
+                'success': False
+            }), 400
+
+        logger.info(f"Processing audio for Whisper optimization: {url}")
+
+        video_id = extract_video_id(url)
+
+        # Background mode: answer 202 now and let the client poll for the result
+        if request.args.get('async', '').lower() in ('1', 'true'):
+            return start_process_job(url, video_id, codec)
+
+        # Serve a previous result for the same video without re-processing
+        cached_path = process_cache_get(video_id, codec)
+        if cached_path:
+            logger.info(f"Serving cached Whisper audio for video {video_id}")
+            return cached_audio_response(cached_path, codec)
+
+        try:
+            body, content_type, headers = process_whisper_audio(url, video_id, codec)
+        except ProcessError as e:
+            return e.response()
+
+        if isinstance(body, TempDirFile):
+            return file_response(body, content_type, headers)
+        return Response(body, content_type=content_type, headers=headers, direct_passthrough=True)
 
     except Exception as e:
         logger.error(f"Unexpected error in /process endpoint: {str(e)}")
-        # Cleanup on error
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         return jsonify({
             'error': f'Internal server error: {str(e)}',
             'success': False
         }), 500
 
+# Segments of one /process_full request compress side by side; each still
+# holds an ffmpeg slot, so no more than FFMPEG_CONCURRENCY encoders run
+segment_executor = ThreadPoolExecutor(max_workers=FFMPEG_CONCURRENCY, thread_name_prefix='segment')
+
+def compress_segments_for_whisper(segments, temp_dir):
+    """Compress all segments in parallel; returns (segment, output file) pairs in order"""
+    futures = {}
+    for segment in segments:
+        output_file = os.path.join(temp_dir, f"cseg_{segment['index']:03d}.m4a")
+        futures[segment_executor.submit(compress_segment_for_whisper, segment, output_file)] = (segment, output_file)
+
+    # Let every encode finish before raising so none is still writing into
+    # a temp directory that is about to be removed
+    futures_wait(futures)
+    for future in futures:
+        future.result()
+    return list(futures.values())
+
+@app.route('/process_full', methods=['GET'])
+def process_full_audio():
+    """Compress every 10-minute segment for Whisper and return them together as a zip"""
+    temp_dir = None
+    try:
+        url = request.args.get('url')
+        if not url:
+            return jsonify({
+                'error': 'Missing required parameter: url',
+                'success': False
+            }), 400
+
+        if not is_valid_youtube_url(url):
+            return jsonify({
+                'error': 'Invalid YouTube URL provided',
+                'success': False
+            }), 400
+
+        logger.info(f"Processing full audio for Whisper: {url}")
+
+        try:
+            extract_result = extract_audio_info(url, 'm4a')
+            if not extract_result.get('success'):
+                return jsonify(extract_result), 500
+            audio_url = extract_result['audio_url']
+        except Exception as e:
+            logger.error(f"Failed to extract audio info: {str(e)}")
+            return jsonify({
+                'error': f'Failed to extract audio: {str(e)}',
+                'success': False
+            }), 500
+
+        try:
+            upstream = http_session.get(audio_url, headers=PROCESS_DOWNLOAD_HEADERS, stream=True, timeout=(5, 120))
+            upstream.raise_for_status()
+            content_length = int(upstream.headers.get('Content-Length') or 0)
+            if content_length > 500 * 1024 * 1024:
+                upstream.close()
+                return file_too_large_error(content_length / (1024*1024)).response()
+            # Input, segments, compressed segments and the zip all live here
+            temp_dir = make_work_dir(content_length, headroom=4)
+            input_file = os.path.join(temp_dir, 'input.m4a')
+            original_size = download_audio_to_file(audio_url, input_file, content_length, upstream)
+            logger.info(f"Downloaded {original_size / (1024*1024):.2f} MB original audio")
+        except Exception as e:
+            logger.error(f"Failed to download audio: {str(e)}")
+            forget_rejected_extraction(url, e)
+            return jsonify({
+                'error': f'Failed to download audio: {str(e)}',
+                'success': False
+            }), 500
+
+        try:
+            segments = segment_audio_for_processing(input_file, temp_dir, max_segment_duration=600)
+            if not segments:
+                raise Exception("Failed to create any audio segments")
+            compressed = compress_segments_for_whisper(segments, temp_dir)
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Compression failed: {error_msg}")
+            if "server busy" in error_msg.lower():
+                return server_busy_error(error_msg).response()
+            return jsonify({
+                'error': f'Audio processing failed: {error_msg}',
+                'success': False
+            }), 500
+
+        # Segments are already compressed, so the archive only stores them
+        archive_file = os.path.join(temp_dir, 'segments.zip')
+        with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_STORED) as archive:
+            for segment, output_file in compressed:
+                archive.write(output_file, f"segment_{segment['index']:03d}.m4a")
+        logger.info(f"All {len(compressed)} segments compressed for Whisper")
+
+        output_stream = TempDirFile(archive_file, temp_dir)
+        response = file_response(output_stream, 'application/zip', {
+            **PROCESS_RESPONSE_HEADERS,
+            'Content-Disposition': 'attachment; filename="segments.zip"',
+            'X-Segment-Count': str(len(compressed)),
+            'X-Segment-Duration': '600',
+        })
+        # The file now owns the temp directory
+        temp_dir = None
+
+        return response
+
+    except Exception as e:
+        logger.error(f"Unexpected error in /process_full endpoint: {str(e)}")
+        return jsonify({
+            'error': f'Internal server error: {str(e)}',
+            'success': False
+        }), 500
+
+    finally:
+        if temp_dir:
+            remove_work_dir(temp_dir)
+
+# Background /process jobs (?async=1). A job runs the normal pipeline and its
+# output lands in the process cache; its state is kept in a marker file next
+# to it, so any worker on the host can answer /status and /result.
+PROCESS_JOB_TIMEOUT = int(os.environ.get('PROCESS_JOB_TIMEOUT', 600))
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+process_executor = ThreadPoolExecutor(max_workers=FFMPEG_CONCURRENCY, thread_name_prefix='process-job')
+process_jobs = set()
+process_jobs_lock = threading.Lock()
+
+def process_job_marker(video_id, codec='aac'):
+    """Path of the marker file holding a background job's state"""
+    name = video_id if codec == 'aac' else f'{video_id}.{codec}'
+    return os.path.join(PROCESS_CACHE_DIR, f'{name}.job')
+
+def write_process_job(video_id, status, error=None, codec='aac'):
+    """Record a background job's state"""
+    marker = process_job_marker(video_id, codec)
+    tmp_path = f'{marker}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps({'status': status, 'error': error}))
+    os.replace(tmp_path, marker)
+
+def read_process_job(video_id, codec='aac'):
+    """State of a background job ('done', 'running' or 'failed'), or None if there is none"""
+    if process_cache_get(video_id, codec):
+        return {'status': 'done', 'error': None}
+    marker = process_job_marker(video_id, codec)
+    try:
+        with open(marker, 'rb') as f:
+            job = orjson.loads(f.read())
+        started = os.stat(marker).st_mtime
+    except (OSError, ValueError):
+        return None
+    if job['status'] == 'running' and time.time() - started > PROCESS_JOB_TIMEOUT:
+        # The worker running it died or the job hung
+        return {'status': 'failed', 'error': 'Job did not finish in time'}
+    return job
+
+def run_process_job(url, video_id, codec='aac'):
+    """Run the /process pipeline for a background job, leaving its output in the process cache"""
+    try:
+        try:
+            # Nobody is waiting on the response, so queue behind foreground
+            # requests for an ffmpeg slot rather than failing as busy
+            body, _, _ = process_whisper_audio(url, video_id, codec, slot_timeout=PROCESS_JOB_TIMEOUT)
+        except ProcessError as e:
+            write_process_job(video_id, 'failed', e.payload.get('error', f'HTTP {e.status}'), codec)
+            return
+        try:
+            # Consuming a streamed body is what writes the cache entry; a
+            # finished file has already been cached
+            if not isinstance(body, TempDirFile):
+                for _ in body:
+                    pass
+        finally:
+            body.close()
+
+        if process_cache_get(video_id, codec):
+            os.remove(process_job_marker(video_id, codec))
+        else:
+            write_process_job(video_id, 'failed', 'Processed audio could not be cached', codec)
+    except Exception as e:
+        logger.error("Background job for video %s failed: %s", video_id, e)
+        try:
+            write_process_job(video_id, 'failed', str(e), codec)
+        except OSError:
+            pass
+    finally:
+        with process_jobs_lock:
+            process_jobs.discard((video_id, codec))
+
+def process_job_payload(video_id, status, error=None, codec='aac'):
+    """JSON body describing a background job"""
+    query = '' if codec == 'aac' else f'?codec={codec}'
+    payload = {
+        'success': status != 'failed',
+        'job_id': video_id,
+        'status': status,
+        'status_url': f'/status/{video_id}{query}',
+        'result_url': f'/result/{video_id}{query}',
+    }
+    if error:
+        payload['error'] = error
+    return payload
+
+def start_process_job(url, video_id, codec='aac'):
+    """Queue a background /process job for a video unless it is already done or running"""
+    if not video_id or not PROCESS_CACHE_MAX_BYTES:
+        return jsonify({
+            'error': 'Background processing needs a video URL and the process cache enabled',
+            'success': False
+        }), 400
+
+    job = read_process_job(video_id, codec)
+    if job and job['status'] == 'done':
+        return jsonify(process_job_payload(video_id, 'done', codec=codec))
+    if job and job['status'] == 'running':
+        return jsonify(process_job_payload(video_id, 'running', codec=codec)), 202
+
+    with process_jobs_lock:
+        if (video_id, codec) in process_jobs:
+            return jsonify(process_job_payload(video_id, 'running', codec=codec)), 202
+        process_jobs.add((video_id, codec))
+
+    try:
+        write_process_job(video_id, 'running', codec=codec)
+        process_executor.submit(run_process_job, url, video_id, codec)
+    except Exception:
+        # e.g. a full disk; without this the video would report a job
+        # that does not exist until the worker restarts
+        with process_jobs_lock:
+            process_jobs.discard((video_id, codec))
+        raise
+    logger.info("Queued background processing for video %s", video_id)
+    return jsonify(process_job_payload(video_id, 'running', codec=codec)), 202
+
+def requested_job(video_id):
+    """(video ID, codec) named by a /status or /result request, or None if either is invalid"""
+    codec = request.args.get('codec', 'aac').lower()
+    if not VIDEO_ID_RE.match(video_id) or codec not in WHISPER_CODECS:
+        return None
+    return video_id, codec
+
+@app.route('/status/<video_id>', methods=['GET'])
+def process_status(video_id):
+    """Report the state of a background /process job"""
+    job_key = requested_job(video_id)
+    job = read_process_job(*job_key) if job_key else None
+    if job is None:
+        return jsonify({
+            'error': 'Unknown job',
+            'success': False
+        }), 404
+    return jsonify(process_job_payload(video_id, job['status'], job.get('error'), job_key[1]))
+
+@app.route('/result/<video_id>', methods=['GET'])
+def process_result(video_id):
+    """Send the output of a finished background /process job"""
+    job_key = requested_job(video_id)
+    cached_path = process_cache_get(*job_key) if job_key else None
+    if cached_path is None:
+        return jsonify({
+            'error': 'Result not available; check /status first',
+            'success': False
+        }), 404
+    return cached_audio_response(cached_path, job_key[1])
+
+# Warm the yt-dlp pool in the background so the health check answers immediately
+threading.Thread(target=warm_ydl_pool, name='ydl-warmup', daemon=True).start()
+
 if __name__ == '__main__':
+    # Local development only; production uses gunicorn (see Dockerfile/Procfile)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""Gunicorn settings, overridable through GUNICORN_* environment variables.
+
+Requests spend most of their time waiting on yt-dlp, YouTube downloads and
+ffmpeg subprocesses, so threaded workers (gthread) give concurrency without
+extra processes. A thread blocked on a socket or pipe costs little, so each
+worker runs enough threads to keep many long /download and /process streams
+open at once.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+# Workers recycled by max_requests get this long to finish streams in flight
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 100))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 10))
@@ -0,0 +1,182 @@
+"""Flask test-client checks for the /process job flow, download tokens and request validation.
+
+yt-dlp is never called: extract_audio_info is replaced by a stub pointing at
+a local HTTP server, so the suite runs offline. Run with
+python -m unittest discover tests (or python -m pytest tests).
+"""
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app as service
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+VIDEO_ID = 'dQw4w9WgXcQ'
+# Under 25MB, so AAC output is relayed as-is and ffmpeg is not needed
+AUDIO = bytes(range(256)) * 4096
+
+class AudioHandler(http.server.BaseHTTPRequestHandler):
+    """Serves AUDIO for any path, standing in for googlevideo"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(len(AUDIO)))
+        self.end_headers()
+        self.wfile.write(AUDIO)
+
+    def log_message(self, *args):
+        pass
+
+class ServiceTestCase(unittest.TestCase):
+    """Test client with extraction stubbed out and a private process cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AudioHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.audio_url = f'http://127.0.0.1:{cls.server.server_address[1]}/audio.m4a'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        for name, value in {
+            'extract_audio_info': self.fake_extract,
+            'PROCESS_CACHE_DIR': cache_dir,
+            'PROCESS_CACHE_MAX_BYTES': 100 * 1024 * 1024,
+            'redis_client': None,
+        }.items():
+            patcher = mock.patch.object(service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = service.app.test_client()
+
+    def fake_extract(self, url, format_preference='m4a'):
+        return {'audio_url': self.audio_url, 'title': 'Test audio', 'duration': 60, 'success': True}
+
+class ProcessJobTest(ServiceTestCase):
+
+    def test_job_lifecycle(self):
+        response = self.client.get('/process', query_string={'url': VIDEO_URL, 'async': '1'})
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['status_url'], f'/status/{VIDEO_ID}')
+
+        deadline = time.monotonic() + 10
+        while True:
+            status = self.client.get(job['status_url']).get_json()
+            if status['status'] != 'running' or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        self.assertEqual(status['status'], 'done', status.get('error'))
+
+        response = self.client.get(job['result_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), AUDIO)
+        response.close()
+
+    def test_failed_marker_write_does_not_leave_a_job(self):
+        with mock.patch.object(service, 'write_process_job', side_effect=OSError('disk full')):
+            response = self.client.get('/process', query_string={'url': VIDEO_URL, 'async': '1'})
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn((VIDEO_ID, 'aac'), service.process_jobs)
+
+    def test_result_before_job(self):
+        self.assertEqual(self.client.get(f'/result/{VIDEO_ID}').status_code, 404)
+        self.assertEqual(self.client.get(f'/status/{VIDEO_ID}').status_code, 404)
+
+    def test_unsupported_codec(self):
+        response = self.client.get('/process', query_string={'url': VIDEO_URL, 'codec': 'mp3'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported codec', response.get_json()['error'])
+
+class DownloadTokenTest(ServiceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(service, 'DOWNLOAD_TOKEN_SECRET', b'test-secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def extract_token(self):
+        response = self.client.get('/extract', query_string={'url': VIDEO_URL})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['download_token']
+
+    def test_token_accepted(self):
+        token = self.extract_token()
+        with mock.patch.object(service, 'extract_audio_info', side_effect=AssertionError('re-extracted')):
+            response = self.client.get('/download', query_string={'token': token})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_data(), AUDIO)
+            response.close()
+
+    def test_tampered_token_rejected(self):
+        signature = self.extract_token().split('.')[1]
+        forged = service.make_download_token({'audio_url': 'http://example.com/other', 'title': 'x'}).split('.')[0]
+        response = self.client.get('/download', query_string={'token': f'{forged}.{signature}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_token_rejected(self):
+        token = self.extract_token()
+        with mock.patch.object(service.time, 'time', return_value=time.time() + service.DOWNLOAD_TOKEN_TTL + 1):
+            response = self.client.get('/download', query_string={'token': token})
+        self.assertEqual(response.status_code, 400)
+
+class BadUrlTest(unittest.TestCase):
+
+    def test_image_urls(self):
+        self.assertTrue(service.is_bad_url('https://i.ytimg.com/sb/dQw4w9WgXcQ/storyboard3_L1/M0.jpg?sqp=x'))
+        self.assertTrue(service.is_bad_url('https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.JPG?v=1'))
+
+    def test_media_url_with_image_query_value(self):
+        self.assertFalse(service.is_bad_url('https://rr1.googlevideo.com/videoplayback?mime=audio%2Fmp4&x=.png'))
+
+class CompressionSettingsTest(unittest.TestCase):
+
+    def test_long_audio_gets_a_lower_bitrate(self):
+        # ~100MB, 128kbps, 109 minutes: 32kbps AAC would pass 25MB
+        bitrate, _, _, _ = service.process_compression_settings(99, 6540, 'aac')
+        self.assertEqual(bitrate, '24k')
+        bitrate, _, _, _ = service.process_compression_settings(99, 6540, 'opus')
+        self.assertEqual(bitrate, '16k')
+        bitrate, _, _, _ = service.process_compression_settings(99, 20000, 'opus')
+        self.assertEqual(bitrate, '8k')
+
+    def test_short_audio_keeps_the_size_tier(self):
+        self.assertEqual(service.process_compression_settings(50, 600, 'aac')[:2], ('32k', '16000'))
+        self.assertEqual(service.process_compression_settings(50, None, 'aac')[:2], ('32k', '16000'))
+
+class WorkDirTest(unittest.TestCase):
+
+    def test_tmpfs_space_is_reserved(self):
+        tmpfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpfs, ignore_errors=True)
+        stat = os.statvfs(tmpfs)
+        size = stat.f_bavail * stat.f_frsize // 3
+        with mock.patch.object(service, 'TMPFS_DIR', tmpfs):
+            first = service.make_work_dir(size, headroom=2)
+            second = service.make_work_dir(size, headroom=2)
+            self.assertEqual(os.path.dirname(first), tmpfs)
+            self.assertNotEqual(os.path.dirname(second), tmpfs)
+            service.remove_work_dir(second)
+            service.remove_work_dir(first)
+            third = service.make_work_dir(size, headroom=2)
+            self.assertEqual(os.path.dirname(third), tmpfs)
+            service.remove_work_dir(third)
+        self.assertEqual(service.tmpfs_reserved, {})
+
+if __name__ == '__main__':
+    unittest.main()
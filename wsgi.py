@@ -0,0 +1,4 @@
+"""WSGI entry point for production servers (gunicorn app:app or wsgi:app)"""
+from app import app
+
+__all__ = ['app']